@@ -2,25 +2,138 @@
 Server that fetches isitchristmas.com, renders it, and returns a screenshot.
 """
 
-from typing import Optional
-from fastapi import FastAPI, Request
-from fastapi.responses import Response
+import asyncio
+import hashlib
+import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Literal, Optional
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 
 import uvicorn
 
+import maxmind
 from maxmind import get_country_from_ip
-from screenshot import capture_isitchristmas_screenshot
+from screenshot import (
+    COUNTRY_CODES,
+    browser_pool,
+    cancel_pending_screenshots,
+    get_cached_screenshot,
+    prewarm_screenshots,
+)
 
 
-app = FastAPI(title="IsItChristmas Screenshot Service")
+logger = logging.getLogger("isitxmas")
+
+app = FastAPI(
+    title="IsItChristmas Screenshot Service", default_response_class=ORJSONResponse
+)
 
 # Mount static files directory for CSS
 app.mount("/styles", StaticFiles(directory="styles"), name="styles")
 
+# Landing page is static, so read it once at import
+with open("templates/index.html", "rb") as f:
+    _INDEX_BYTES = f.read()
+
+_INDEX_ETAG = f'"{hashlib.sha256(_INDEX_BYTES).hexdigest()[:32]}"'
+_INDEX_HEADERS = {"Cache-Control": "public, max-age=3600", "ETag": _INDEX_ETAG}
+
+# Responses are immutable, so build them once and return the same objects
+_INDEX_RESPONSE = HTMLResponse(content=_INDEX_BYTES, headers=_INDEX_HEADERS)
+_INDEX_NOT_MODIFIED = Response(status_code=304, headers=_INDEX_HEADERS)
+
+
+_prewarm_task: Optional[asyncio.Task] = None
+_log_listener: Optional[QueueListener] = None
+_log_handler: Optional[QueueHandler] = None
+
+
+def configure_logging():
+    """
+    Route the service's log records through a queue so request handlers only
+    enqueue them; a background listener thread does the actual writing.
+
+    The level comes from ISITXMAS_LOG_LEVEL (default INFO); use WARNING in
+    production to skip per-request messages entirely.
+    """
+    global _log_listener, _log_handler
+
+    if _log_listener is not None:
+        return
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    )
+    _log_listener = QueueListener(log_queue, stream_handler)
+    _log_listener.start()
+
+    _log_handler = QueueHandler(log_queue)
+    logger.addHandler(_log_handler)
+    logger.setLevel(os.environ.get("ISITXMAS_LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+
+@app.on_event("startup")
+async def startup():
+    """
+    Start the shared Playwright browser pool and prewarm the screenshot cache
+    """
+    global _prewarm_task
+
+    configure_logging()
+    maxmind.log_loaded_databases()
+    await browser_pool.start()
+    _prewarm_task = asyncio.create_task(prewarm_screenshots())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """
+    Close the pooled browsers and stop Playwright
+    """
+    global _log_listener, _log_handler
+
+    # Stop renders before their browser contexts are closed under them
+    if _prewarm_task is not None:
+        _prewarm_task.cancel()
+        await asyncio.gather(_prewarm_task, return_exceptions=True)
+    await cancel_pending_screenshots()
+    await browser_pool.stop()
+
+    # Flush queued log records and detach the queue from the logger
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+        logger.removeHandler(_log_handler)
+        _log_handler = None
+
+
+async def _lookup_country(client_ip: str) -> str:
+    """
+    Resolve a client IP to a country without blocking the event loop
+    """
+    # Private IPv4 and in-memory table hits are answered inline; anything that
+    # needs the mmdb reader (IPv6, table misses) can page-fault on disk, so it
+    # runs in a worker thread
+    country = maxmind.get_country_from_table(client_ip)
+    if country is None:
+        country = await asyncio.to_thread(get_country_from_ip, client_ip)
+    return country
+
 
 @app.get("/screenshot")
-async def get_screenshot(request: Request, country: Optional[str] = None):
+async def get_screenshot(
+    request: Request,
+    country: Optional[str] = None,
+    format: Literal["jpeg", "png"] = "jpeg",
+):
     """
     Screenshot endpoint that returns a screenshot of isitchristmas.com
 
@@ -29,6 +142,7 @@ async def get_screenshot(request: Request, country: Optional[str] = None):
         country: Optional two-letter country code to override IP detection
                  If not provided, uses IP-based geolocation
                  Examples: US, FR, DE, JP, SE, etc.
+        format: Image format, "jpeg" (default) or "png" for a lossless image
     """
     # If country not specified, detect from IP
     if country is None:
@@ -37,31 +151,41 @@ async def get_screenshot(request: Request, country: Optional[str] = None):
         if not client_ip:
             client_ip = request.client.host if request.client else "127.0.0.1"
 
-        country = get_country_from_ip(client_ip)
-        print(f"Detected IP: {client_ip} → Country: {country}")
+        country = await _lookup_country(client_ip)
+        logger.info("Detected IP: %s → Country: %s", client_ip, country)
+        if country not in COUNTRY_CODES:
+            country = "GB"
     else:
         country = country.upper()
-        print(f"Using provided country: {country}")
+        logger.info("Using provided country: %s", country)
+        if country not in COUNTRY_CODES:
+            raise HTTPException(
+                status_code=400, detail=f"Invalid country code: {country!r}"
+            )
 
-    screenshot = await capture_isitchristmas_screenshot(country)
+    screenshot = await get_cached_screenshot(country, format)
 
+    extension = "png" if format == "png" else "jpg"
+    filename = f"isitchristmas-{country}.{extension}"
     return Response(
         content=screenshot,
-        media_type="image/png",
+        media_type=f"image/{format}",
         headers={
-            "Content-Disposition": f"inline; filename=isitchristmas-{country}.png"
+            "Content-Length": str(len(screenshot)),
+            "Content-Disposition": f"inline; filename={filename}",
         },
     )
 
 
 @app.get("/")
-async def index():
+async def index(request: Request):
     """
     Main landing page with animated progress UI
     """
-    f = open("templates/index.html", encoding="utf8")
-    html_content = f.read()
-    return Response(content=html_content, media_type="text/html")
+    if request.headers.get("If-None-Match") == _INDEX_ETAG:
+        return _INDEX_NOT_MODIFIED
+
+    return _INDEX_RESPONSE
 
 
 @app.get("/health")
@@ -76,8 +200,16 @@ def main():
     """
     Entry point for running the server
     """
-
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # A single worker: requests mostly wait on the browser pool, which already
+    # renders concurrently, and extra workers would each start their own pool,
+    # prewarm and screenshot cache. uvloop is unavailable on Windows.
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=8000,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+    )
 
 
 if __name__ == "__main__":
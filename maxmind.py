@@ -2,11 +2,20 @@
 GeoIP functionality using MaxMind GeoLite2-Country database.
 """
 
+import csv
 import ipaddress
+import logging
+import socket
+import struct
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
 import geoip2.database
 import geoip2.errors
+import numpy as np
+
+
+logger = logging.getLogger("isitxmas.maxmind")
 
 
 # Try to load MaxMind GeoIP database (optional)
@@ -20,42 +29,203 @@ GEOIP_DB_PATHS = [
 ]
 
 geoip_reader: Optional[geoip2.database.Reader] = None
+geoip_db_path: Optional[Path] = None
 
 # Try to initialize the GeoIP reader
 for db_path in GEOIP_DB_PATHS:
     if db_path.exists():
         try:
             geoip_reader = geoip2.database.Reader(str(db_path))
-            print(f"[OK] GeoIP database loaded from {db_path}")
+            geoip_db_path = db_path
             break
         except Exception as e:
-            print(f"[WARNING] Failed to load GeoIP database from {db_path}: {e}")
+            logger.warning("Failed to load GeoIP database from %s: %s", db_path, e)
 
 if geoip_reader is None:
-    print("[WARNING] GeoIP database not found in any standard location")
-    print("  Checked:")
-    for db_path in GEOIP_DB_PATHS:
-        print(f"    - {db_path}")
-    print("  Country detection will use query parameter or default to GB")
+    logger.warning(
+        "GeoIP database not found in any standard location\n"
+        "  Checked:\n%s\n"
+        "  Country detection will use query parameter or default to GB",
+        "\n".join(f"    - {db_path}" for db_path in GEOIP_DB_PATHS),
+    )
+
+
+# Optional GeoLite2-Country CSV export, used for fast IPv4 lookups.
+# Each directory must contain the Blocks-IPv4 and Locations-en files.
+GEOIP_CSV_PATHS = [
+    Path(
+        r"C:\ProgramData\MaxMind\GeoIPUpdate\GeoIP\GeoLite2-Country-CSV"
+    ),  # Windows MaxMind default
+    Path("GeoLite2-Country-CSV"),  # Current directory
+    Path("/usr/share/GeoIP/GeoLite2-Country-CSV"),  # Linux default
+]
+
+
+def load_country_csv(csv_dir: Path) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Build a sorted IPv4 range table from a GeoLite2-Country CSV export.
+
+    Args:
+        csv_dir: Directory containing GeoLite2-Country-Blocks-IPv4.csv and
+                 GeoLite2-Country-Locations-en.csv
+
+    Returns:
+        (starts, ends, codes) arrays: inclusive uint32 range bounds sorted by
+        start, and the matching two-letter country codes as bytes
+    """
+    locations = {}
+    with open(
+        csv_dir / "GeoLite2-Country-Locations-en.csv", encoding="utf8", newline=""
+    ) as f:
+        for row in csv.DictReader(f):
+            if row["country_iso_code"]:
+                locations[row["geoname_id"]] = row["country_iso_code"]
+
+    starts, ends, codes = [], [], []
+    with open(
+        csv_dir / "GeoLite2-Country-Blocks-IPv4.csv", encoding="utf8", newline=""
+    ) as f:
+        for row in csv.DictReader(f):
+            code = locations.get(row["geoname_id"])
+            if code is None:
+                continue
+            network = ipaddress.IPv4Network(row["network"])
+            starts.append(int(network.network_address))
+            ends.append(int(network.broadcast_address))
+            codes.append(code)
+
+    starts_arr = np.array(starts, dtype=np.uint32)
+    order = np.argsort(starts_arr, kind="stable")
+    return (
+        starts_arr[order],
+        np.array(ends, dtype=np.uint32)[order],
+        np.array(codes, dtype="S2")[order],
+    )
+
+
+# Private and loopback IPv4 ranges as inclusive integer bounds
+_PRIVATE_RANGES = [
+    (0x0A000000, 0x0AFFFFFF),  # 10.0.0.0/8
+    (0xAC100000, 0xAC1FFFFF),  # 172.16.0.0/12
+    (0xC0A80000, 0xC0A8FFFF),  # 192.168.0.0/16
+    (0x7F000000, 0x7FFFFFFF),  # 127.0.0.0/8
+]
+
+ipv4_starts: Optional[np.ndarray] = None
+ipv4_ends: Optional[np.ndarray] = None
+ipv4_codes: Optional[np.ndarray] = None
+geoip_csv_path: Optional[Path] = None
+
+# Try to load the CSV range table
+for csv_dir in GEOIP_CSV_PATHS:
+    if csv_dir.is_dir():
+        try:
+            ipv4_starts, ipv4_ends, ipv4_codes = load_country_csv(csv_dir)
+            geoip_csv_path = csv_dir
+            break
+        except Exception as e:
+            logger.warning("Failed to load GeoIP CSV table from %s: %s", csv_dir, e)
+
+
+def log_loaded_databases():
+    """
+    Log which GeoIP data was loaded at import.
+
+    Loading happens before the app configures logging, so the app calls this
+    from its startup hook for the messages to be shown. Load failures are
+    logged as warnings at import and still show up without configuration.
+    """
+    if geoip_db_path is not None:
+        logger.info("GeoIP database loaded from %s", geoip_db_path)
+    if geoip_csv_path is not None:
+        logger.info("GeoIP CSV table loaded from %s", geoip_csv_path)
+
+
+def _lookup_ipv4_table(ip_int: int) -> Optional[str]:
+    """
+    Binary search the CSV range table for an IPv4 address as an integer.
+    """
+    if ipv4_starts is None:
+        return None
+
+    idx = int(np.searchsorted(ipv4_starts, ip_int, side="right")) - 1
+    if idx >= 0 and ip_int <= ipv4_ends[idx]:
+        return ipv4_codes[idx].decode()
+    return None
+
+
+def _parse_ipv4(ip_address: str) -> Optional[int]:
+    """
+    Parse a dotted-quad IPv4 address to an integer, or None if it isn't one.
+    """
+    try:
+        return struct.unpack(">I", socket.inet_pton(socket.AF_INET, ip_address))[0]
+    except (OSError, ValueError):
+        return None
+
+
+def _is_private_ipv4(ip_int: int) -> bool:
+    for start, end in _PRIVATE_RANGES:
+        if start <= ip_int <= end:
+            return True
+    return False
 
 
+def get_country_from_table(ip_address: str) -> Optional[str]:
+    """
+    Get country code from IP address without touching the mmdb reader.
+
+    Only private IPv4 addresses and IPv4 addresses in the CSV range table can
+    be answered this way; the lookup is pure computation, so it's safe to call
+    from the event loop.
+
+    Args:
+        ip_address: IP address string
+
+    Returns:
+        Two-letter country code, or None if get_country_from_ip is needed
+    """
+    ip_int = _parse_ipv4(ip_address)
+    if ip_int is None:
+        return None
+    if _is_private_ipv4(ip_int):
+        return "GB"  # Default for local requests
+    return _lookup_ipv4_table(ip_int)
+
+
+@lru_cache(maxsize=65536)
 def get_country_from_ip(ip_address: str) -> str:
     """
     Get country code from IP address using MaxMind GeoIP2.
 
+    Results are memoized; call reset_cache() after swapping the database.
+
     Args:
         ip_address: IP address string
 
     Returns:
         Two-letter country code (defaults to GB for local/private IPs)
     """
-    # Check if IP is local/private
-    try:
-        ip_obj = ipaddress.ip_address(ip_address)
-        if ip_obj.is_private or ip_obj.is_loopback:
+    # Parse dotted-quad IPv4 straight to an integer
+    ip_int = _parse_ipv4(ip_address)
+
+    if ip_int is not None:
+        # Check if IP is local/private
+        if _is_private_ipv4(ip_int):
             return "GB"  # Default for local requests
-    except ValueError:
-        return "GB"
+
+        # Try the in-memory range table
+        country_code = _lookup_ipv4_table(ip_int)
+        if country_code:
+            return country_code
+    else:
+        # IPv6 or invalid input
+        try:
+            ip_obj = ipaddress.ip_address(ip_address)
+            if ip_obj.is_private or ip_obj.is_loopback:
+                return "GB"  # Default for local requests
+        except ValueError:
+            return "GB"
 
     # Try GeoIP lookup if database is available
     if geoip_reader:
@@ -67,6 +237,48 @@ def get_country_from_ip(ip_address: str) -> str:
         except geoip2.errors.AddressNotFoundError:
             pass
         except Exception as e:
-            print(f"GeoIP lookup error for {ip_address}: {e}")
+            logger.warning("GeoIP lookup error for %s: %s", ip_address, e)
 
     return "GB"  # Default fallback
+
+
+def get_countries_from_ints(ips: np.ndarray) -> np.ndarray:
+    """
+    Get country codes for a batch of IPv4 addresses.
+
+    Addresses covered by the CSV range table are resolved with one vectorized
+    search; the rest go through get_country_from_ip individually.
+
+    Args:
+        ips: IPv4 addresses as unsigned 32-bit integers
+
+    Returns:
+        Array of two-letter country codes (dtype S2), GB for local/private IPs
+    """
+    ips = np.asarray(ips, dtype=np.uint32)
+    result = np.full(ips.shape, b"GB", dtype="S2")
+
+    private = np.zeros(ips.shape, dtype=bool)
+    for start, end in _PRIVATE_RANGES:
+        private |= (ips >= start) & (ips <= end)
+
+    missing = ~private
+    if ipv4_starts is not None and len(ipv4_starts):
+        idx = np.searchsorted(ipv4_starts, ips, side="right") - 1
+        safe_idx = np.maximum(idx, 0)
+        found = missing & (idx >= 0) & (ips <= ipv4_ends[safe_idx])
+        result[found] = ipv4_codes[safe_idx[found]]
+        missing &= ~found
+
+    for i in np.flatnonzero(missing):
+        ip_address = socket.inet_ntoa(struct.pack(">I", int(ips[i])))
+        result[i] = get_country_from_ip(ip_address).encode()
+
+    return result
+
+
+def reset_cache():
+    """
+    Clear memoized lookups, e.g. after a GeoIP database update.
+    """
+    get_country_from_ip.cache_clear()
@@ -2,60 +2,442 @@
 Screenshot capture functionality using Playwright.
 """
 
-import re
-from playwright.async_api import async_playwright
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+from datetime import date
+from pathlib import Path
+from typing import IO, Dict, List, Optional, Tuple
 
+from playwright.async_api import BrowserContext, Playwright, async_playwright
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
 
-async def capture_isitchristmas_screenshot(country_code: str = "SE") -> bytes:
+
+logger = logging.getLogger("isitxmas.screenshot")
+
+# Number of warm browsers kept in the pool
+POOL_SIZE = 2 * (os.cpu_count() or 1)
+
+BROWSER_ARGS = ["--no-sandbox", "--disable-dev-shm-usage"]
+
+VIEWPORT = {"width": 1920, "height": 1080}
+
+# Pages rendered on a context before it is closed and relaunched, so memory
+# doesn't grow unbounded. The profile directory, and its caches, is kept.
+CONTEXT_MAX_USES = 200
+
+# Chromium profiles (HTTP, code and shader caches) persist here between requests.
+# Point this at a tmpfs or SSD in production. Each process locks the slot
+# directories it uses, so several processes can share the same root.
+PROFILE_DIR = Path(
+    os.environ.get(
+        "ISITXMAS_PROFILE_DIR", Path(tempfile.gettempdir()) / "isitxmas-profile"
+    )
+)
+
+SITE_URL = "https://isitchristmas.com/"
+
+# Fonts and media don't affect the screenshot and are blocked, matched by
+# extension with or without a query string. Images are kept since the page
+# shows visitors' flags. Blocking goes through CDP's Network.setBlockedURLs
+# rather than Playwright routes, because any route disables the HTTP cache.
+BLOCKED_EXTENSIONS = (
+    "woff", "woff2", "ttf", "otf", "eot", "mp3", "mp4", "ogg", "wav", "webm"
+)
+BLOCKED_URL_PATTERNS = [
+    pattern
+    for extension in BLOCKED_EXTENSIONS
+    for pattern in (f"*.{extension}", f"*.{extension}?*")
+]
+
+# Element holding the localised yes/no answer, and how long to wait for it (ms)
+ANSWER_SELECTOR = "#answer"
+ANSWER_TIMEOUT = 3000
+
+# Screenshots are clipped to the viewport; JPEG unless PNG is asked for
+SCREENSHOT_CLIP = {"x": 0, "y": 0, **VIEWPORT}
+JPEG_QUALITY = 85
+
+# Countries rendered at startup so the most common requests start out cached
+PREWARM_COUNTRIES = ("US", "GB", "DE", "FR", "JP", "SE", "AU", "CA")
+
+# ISO 3166-1 alpha-2 codes, plus XK (Kosovo) which GeoIP databases return.
+# Only these are rendered, which also bounds the screenshot cache.
+COUNTRY_CODES = frozenset(
+    (
+        "AD", "AE", "AF", "AG", "AI", "AL", "AM", "AO", "AQ", "AR", "AS", "AT",
+        "AU", "AW", "AX", "AZ", "BA", "BB", "BD", "BE", "BF", "BG", "BH", "BI",
+        "BJ", "BL", "BM", "BN", "BO", "BQ", "BR", "BS", "BT", "BV", "BW", "BY",
+        "BZ", "CA", "CC", "CD", "CF", "CG", "CH", "CI", "CK", "CL", "CM", "CN",
+        "CO", "CR", "CU", "CV", "CW", "CX", "CY", "CZ", "DE", "DJ", "DK", "DM",
+        "DO", "DZ", "EC", "EE", "EG", "EH", "ER", "ES", "ET", "FI", "FJ", "FK",
+        "FM", "FO", "FR", "GA", "GB", "GD", "GE", "GF", "GG", "GH", "GI", "GL",
+        "GM", "GN", "GP", "GQ", "GR", "GS", "GT", "GU", "GW", "GY", "HK", "HM",
+        "HN", "HR", "HT", "HU", "ID", "IE", "IL", "IM", "IN", "IO", "IQ", "IR",
+        "IS", "IT", "JE", "JM", "JO", "JP", "KE", "KG", "KH", "KI", "KM", "KN",
+        "KP", "KR", "KW", "KY", "KZ", "LA", "LB", "LC", "LI", "LK", "LR", "LS",
+        "LT", "LU", "LV", "LY", "MA", "MC", "MD", "ME", "MF", "MG", "MH", "MK",
+        "ML", "MM", "MN", "MO", "MP", "MQ", "MR", "MS", "MT", "MU", "MV", "MW",
+        "MX", "MY", "MZ", "NA", "NC", "NE", "NF", "NG", "NI", "NL", "NO", "NP",
+        "NR", "NU", "NZ", "OM", "PA", "PE", "PF", "PG", "PH", "PK", "PL", "PM",
+        "PN", "PR", "PS", "PT", "PW", "PY", "QA", "RE", "RO", "RS", "RU", "RW",
+        "SA", "SB", "SC", "SD", "SE", "SG", "SH", "SI", "SJ", "SK", "SL", "SM",
+        "SN", "SO", "SR", "SS", "ST", "SV", "SX", "SY", "SZ", "TC", "TD", "TF",
+        "TG", "TH", "TJ", "TK", "TL", "TM", "TN", "TO", "TR", "TT", "TV", "TW",
+        "TZ", "UA", "UG", "UM", "US", "UY", "UZ", "VA", "VC", "VE", "VG", "VI",
+        "VN", "VU", "WF", "WS", "XK", "YE", "YT", "ZA", "ZM", "ZW"
+    )
+)
+
+# Rendered screenshots keyed by (country, format), valid for one calendar day
+_SCREENSHOT_CACHE: Dict[Tuple[str, str], Tuple[date, bytes]] = {}
+
+# In-flight renders, so concurrent misses for the same key share one render
+_PENDING_SCREENSHOTS: Dict[Tuple[str, str], asyncio.Future] = {}
+
+
+class BrowserPool:
+    """
+    Pool of warm headless Chromium browsers shared between requests.
+
+    A single Playwright instance is started once and ``size`` persistent
+    browser contexts are launched up front, each with its own profile
+    directory so caches survive between requests. Requests borrow a context
+    with ``acquire()`` and hand it back with ``release()``; the semaphore
+    bounds concurrent renders.
+    """
+
+    def __init__(self, size: int = POOL_SIZE):
+        self.size = size
+        self._playwright: Optional[Playwright] = None
+        self._profiles: List[Path] = []
+        self._profile_locks: List[IO] = []
+        self._contexts: List[Optional[BrowserContext]] = []
+        self._uses: List[int] = []
+        self._idle: List[int] = []
+        self._leased: Dict[BrowserContext, int] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def start(self):
+        """
+        Start Playwright and pre-launch the pool's browser contexts
+        """
+        if self._playwright is not None:
+            return
+
+        self._profiles, self._profile_locks = _claim_profiles(self.size)
+        try:
+            self._playwright = await async_playwright().start()
+
+            # Launch concurrently so startup costs one cold start, not size of them
+            results = await asyncio.gather(
+                *(self._launch(slot) for slot in range(self.size)),
+                return_exceptions=True,
+            )
+            self._contexts = [None] * self.size
+            for slot, result in enumerate(results):
+                if not isinstance(result, BaseException):
+                    self._add_context(slot, result)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+        except BaseException:
+            # Close whatever did launch so a later start() can retry cleanly
+            await self.stop()
+            raise
+
+        self._uses = [0] * self.size
+        self._idle = list(range(self.size))
+        self._semaphore = asyncio.Semaphore(self.size)
+
+    async def stop(self):
+        """
+        Close every browser context and stop Playwright
+        """
+        for context in self._contexts:
+            if context is not None:
+                await context.close()
+        self._contexts = []
+        self._uses = []
+        self._idle = []
+        self._leased = {}
+        self._semaphore = None
+
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+        # Hand the profile directories back to other processes
+        for lock in self._profile_locks:
+            lock.close()
+        self._profiles = []
+        self._profile_locks = []
+
+    async def acquire(self) -> BrowserContext:
+        """
+        Wait for a free browser context and take it out of the pool
+        """
+        if self._semaphore is None:
+            raise RuntimeError("Browser pool has not been started")
+
+        await self._semaphore.acquire()
+        slot = self._idle.pop()
+        try:
+            context = self._contexts[slot]
+            if context is None or self._uses[slot] >= CONTEXT_MAX_USES:
+                # Relaunch worn-out contexts, and crashed or failed ones
+                self._contexts[slot] = None
+                if context is not None:
+                    await context.close()
+                context = await self._launch(slot)
+                self._add_context(slot, context)
+                self._uses[slot] = 0
+        except BaseException:
+            self._idle.append(slot)
+            self._semaphore.release()
+            raise
+
+        self._uses[slot] += 1
+        self._leased[context] = slot
+        return context
+
+    def release(self, context: BrowserContext):
+        """
+        Return a browser context to the pool
+        """
+        slot = self._leased.pop(context, None)
+
+        # Renders finishing after stop() have nothing to return to
+        if self._semaphore is None or slot is None:
+            return
+
+        self._idle.append(slot)
+        self._semaphore.release()
+
+    def _add_context(self, slot: int, context: BrowserContext):
+        self._contexts[slot] = context
+
+        # A crashed or killed browser closes its context; clear the slot so
+        # the next acquire() relaunches it instead of handing out a dead one
+        def on_close(_):
+            if slot < len(self._contexts) and self._contexts[slot] is context:
+                self._contexts[slot] = None
+
+        context.on("close", on_close)
+
+    async def _launch(self, slot: int) -> BrowserContext:
+        user_data_dir = self._profiles[slot]
+        user_data_dir.mkdir(parents=True, exist_ok=True)
+        return await self._playwright.chromium.launch_persistent_context(
+            str(user_data_dir), headless=True, args=BROWSER_ARGS, viewport=VIEWPORT
+        )
+
+
+def _lock_file(path: Path) -> Optional[IO]:
+    """
+    Take a non-blocking exclusive lock on path, or return None if another
+    process (or pool) holds it. The lock lasts until the file is closed.
+    """
+    f = open(path, "a+")
+    f.seek(0)
+    try:
+        if sys.platform == "win32":
+            import msvcrt
+
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (BlockingIOError, PermissionError):
+        f.close()
+        return None
+    except Exception:
+        f.close()
+        raise
+    return f
+
+
+def _claim_profiles(count: int) -> Tuple[List[Path], List[IO]]:
+    """
+    Claim count free profile directories under PROFILE_DIR.
+
+    Chromium only lets one process use a profile directory at a time, so slots
+    already locked by other workers, app instances or test runs are skipped.
+    The OS drops a lock when its holder exits, so directories (and their
+    caches) are picked up again after a restart.
+
+    Returns:
+        The claimed directories and the open lock files that hold them
+    """
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+
+    profiles: List[Path] = []
+    locks: List[IO] = []
+    index = 0
+    while len(profiles) < count:
+        lock = _lock_file(PROFILE_DIR / f"slot-{index}.lock")
+        if lock is not None:
+            profiles.append(PROFILE_DIR / f"slot-{index}")
+            locks.append(lock)
+        index += 1
+
+    return profiles, locks
+
+
+browser_pool = BrowserPool()
+
+
+def _country_init_script(country_code: str) -> str:
+    """
+    JavaScript that pins the page's global ``country`` to country_code.
+
+    The page declares ``var country = "XX";`` with the server-detected code.
+    Defining ``window.country`` as an accessor before any page script runs
+    makes that declaration reuse the existing property, and its assignment
+    hits the no-op setter, so the document never has to be intercepted.
+    """
+    return (
+        "Object.defineProperty(window, 'country', {"
+        f"get: () => {json.dumps(country_code)}, set: () => {{}}, configurable: true"
+        "});"
+    )
+
+
+async def capture_isitchristmas_screenshot(
+    country_code: str = "SE", image_format: str = "jpeg"
+) -> bytes:
     """
     Fetches isitchristmas.com, renders it with a headless browser,
-    and returns a PNG screenshot.
+    and returns a screenshot of the viewport.
 
     Args:
         country_code: The country code to inject (default: "SE" for Sweden)
+        image_format: "jpeg" (default) or "png" for a lossless image
 
     Returns:
-        PNG screenshot as bytes
-    """
-    async with async_playwright() as p:
-        # Launch headless browser
-        browser = await p.chromium.launch(headless=True)
-        page = await browser.new_page(viewport={"width": 1920, "height": 1080})
-
-        # Intercept the main HTML document and modify the country code
-        async def handle_route(route):
-            # Only intercept the main document
-            if route.request.resource_type == "document":
-                # Fetch the original response
-                response = await route.fetch()
-                body = await response.text()
-
-                # Replace the server-generated country code with our desired one
-                # Pattern matches: var country = "XX"; or var country = 'XX';
-                modified_body = re.sub(
-                    r'var country = ["\'][A-Z]{2}["\'];',
-                    f'var country = "{country_code}";',
-                    body,
+        Screenshot as bytes in the requested format
+
+    Raises:
+        ValueError: If country_code is not in COUNTRY_CODES
+    """
+    # The code ends up in the page's JavaScript, so only allow known countries
+    if country_code not in COUNTRY_CODES:
+        raise ValueError(f"Invalid country code: {country_code!r}")
+
+    context = await browser_pool.acquire()
+    try:
+        # Each request gets a new page on a warm, cache-primed context
+        page = await context.new_page()
+        try:
+            # Runs before the page's own scripts and overrides its country.
+            # No Playwright routes are used, so Chromium's HTTP cache stays on.
+            await page.add_init_script(_country_init_script(country_code))
+
+            cdp = await context.new_cdp_session(page)
+            await cdp.send("Network.enable")
+            await cdp.send("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+
+            # Navigate to isitchristmas.com
+            await page.goto(SITE_URL, wait_until="networkidle")
+
+            # Wait for the answer to be shown instead of sleeping a fixed time
+            try:
+                await page.wait_for_selector(
+                    ANSWER_SELECTOR, state="visible", timeout=ANSWER_TIMEOUT
                 )
+            except PlaywrightTimeoutError:
+                pass  # Screenshot whatever has rendered
+            await page.evaluate("document.fonts.ready")
+
+            # Take screenshot
+            if image_format == "png":
+                return await page.screenshot(type="png", clip=SCREENSHOT_CLIP)
+            return await page.screenshot(
+                type="jpeg", quality=JPEG_QUALITY, clip=SCREENSHOT_CLIP
+            )
+        finally:
+            await page.close()
+    finally:
+        browser_pool.release(context)
+
+
+async def get_cached_screenshot(
+    country_code: str = "SE", image_format: str = "jpeg"
+) -> bytes:
+    """
+    Returns today's screenshot for a country, rendering it on a cache miss.
+
+    The page only changes per country and calendar day, so screenshots are
+    kept until the date rolls over.
+
+    Args:
+        country_code: The country code to inject (default: "SE" for Sweden)
+        image_format: "jpeg" (default) or "png" for a lossless image
+
+    Returns:
+        Screenshot as bytes in the requested format
+    """
+    key = (country_code, image_format)
+    today = date.today()
+
+    hit = _SCREENSHOT_CACHE.get(key)
+    if hit and hit[0] == today:
+        return hit[1]
+
+    pending = _PENDING_SCREENSHOTS.get(key)
+    if pending is None:
+        pending = asyncio.ensure_future(_render_and_cache(key, today))
+        _PENDING_SCREENSHOTS[key] = pending
+        pending.add_done_callback(lambda _: _PENDING_SCREENSHOTS.pop(key, None))
 
-                # Return the modified HTML
-                await route.fulfill(response=response, body=modified_body)
-            else:
-                # Let other resources (JS, CSS, images) load normally
-                await route.continue_()
+    # Shield the shared render from a single disconnecting client
+    return await asyncio.shield(pending)
 
-        # Set up the route interception
-        await page.route("**/*", handle_route)
 
-        # Navigate to isitchristmas.com
-        await page.goto("https://isitchristmas.com", wait_until="networkidle")
+async def _render_and_cache(key: Tuple[str, str], today: date) -> bytes:
+    screenshot = await capture_isitchristmas_screenshot(*key)
 
-        # Wait a bit for any animations/websockets to settle
-        await page.wait_for_timeout(2000)
+    # Drop screenshots from earlier days so the cache never outgrows one day.
+    # Only strictly older ones: a render that started before midnight must
+    # not evict entries already rendered for the new day.
+    for stale_key, (day, _) in list(_SCREENSHOT_CACHE.items()):
+        if day < today:
+            del _SCREENSHOT_CACHE[stale_key]
 
-        # Take screenshot
-        screenshot_bytes = await page.screenshot(type="png", full_page=True)
+    if key not in _SCREENSHOT_CACHE:
+        _SCREENSHOT_CACHE[key] = (today, screenshot)
+    return screenshot
 
-        await browser.close()
 
-        return screenshot_bytes
+async def cancel_pending_screenshots():
+    """
+    Cancel in-flight renders and wait for them to finish unwinding.
+
+    Must run before the browser pool is stopped, since the renders are
+    shielded from their callers and would otherwise outlive it.
+    """
+    pending = list(_PENDING_SCREENSHOTS.values())
+    for future in pending:
+        future.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def prewarm_screenshots():
+    """
+    Render the default-format screenshot for each of PREWARM_COUNTRIES.
+
+    Renders run concurrently; the browser pool limits how many are in flight.
+    """
+    results = await asyncio.gather(
+        *(get_cached_screenshot(country_code) for country_code in PREWARM_COUNTRIES),
+        return_exceptions=True,
+    )
+    for country_code, result in zip(PREWARM_COUNTRIES, results):
+        if isinstance(result, Exception):
+            logger.warning(
+                "Failed to prewarm screenshot for %s: %s", country_code, result
+            )
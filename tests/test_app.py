@@ -0,0 +1,52 @@
+import asyncio
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+import app
+import maxmind
+
+
+def lookup_with_threads(monkeypatch, ip):
+    """Runs app._lookup_country, returning the country and the IPs that were
+    sent to a worker thread."""
+    threaded = []
+
+    async def fake_to_thread(func, *args):
+        threaded.extend(args)
+        return func(*args)
+
+    monkeypatch.setattr(app.asyncio, "to_thread", fake_to_thread)
+    return asyncio.run(app._lookup_country(ip)), threaded
+
+
+def test_ipv6_lookup_runs_in_thread(monkeypatch):
+    monkeypatch.setattr(maxmind, "ipv4_starts", np.array([0], dtype=np.uint32))
+    monkeypatch.setattr(maxmind, "ipv4_ends", np.array([0], dtype=np.uint32))
+    monkeypatch.setattr(maxmind, "ipv4_codes", np.array([b"SE"], dtype="S2"))
+
+    _, threaded = lookup_with_threads(monkeypatch, "2001:4860:4860::8888")
+    assert threaded == ["2001:4860:4860::8888"]
+
+
+def test_table_hits_and_private_ips_stay_inline(monkeypatch):
+    monkeypatch.setattr(maxmind, "ipv4_starts", np.array([0x05960000], dtype=np.uint32))
+    monkeypatch.setattr(maxmind, "ipv4_ends", np.array([0x0596FFFF], dtype=np.uint32))
+    monkeypatch.setattr(maxmind, "ipv4_codes", np.array([b"SE"], dtype="S2"))
+
+    assert lookup_with_threads(monkeypatch, "5.150.12.34") == ("SE", [])
+    assert lookup_with_threads(monkeypatch, "192.168.0.10") == ("GB", [])
+
+    # Table misses fall back to the mmdb reader in a thread
+    _, threaded = lookup_with_threads(monkeypatch, "8.8.8.8")
+    assert threaded == ["8.8.8.8"]
+
+
+def test_invalid_country_is_rejected_before_rendering(monkeypatch):
+    async def fail_render(country_code, image_format):
+        raise AssertionError("should not render")
+
+    monkeypatch.setattr(app, "get_cached_screenshot", fail_render)
+    response = TestClient(app.app).get("/screenshot", params={"country": "ZZ"})
+    assert response.status_code == 400
+    assert "ZZ" in response.json()["detail"]
@@ -1,28 +1,53 @@
-import random as rand
+import socket
+import struct
 
+import numpy as np
 import pytest
 import pycountry
 import maxmind
 
 
-VALID_COUNTRIES = {c.alpha_2 for c in pycountry.countries}  # type: ignore[attr-defined]
+@pytest.fixture(scope="session")
+def valid_countries():
+    return frozenset(c.alpha_2 for c in pycountry.countries)  # type: ignore
 
 
-def is_valid_country(code: str):
-    assert code in VALID_COUNTRIES, f"Invalid country code returned: {code}"
+def is_valid_country(code: str, valid_countries: frozenset):
+    assert code in valid_countries, f"Invalid country code returned: {code}"
 
 
-def gen_rand_ipv4():
-    """Generates a random IPv4 address."""
-    octets = [str(rand.randint(0, 255)) for _ in range(4)]
-    return ".".join(octets)
+def test_1000_random_ips(valid_countries):
+    ips = np.random.default_rng().integers(0, 2**32, 1000, dtype=np.uint32)
+    codes = maxmind.get_countries_from_ints(ips)
 
+    valid = np.array(sorted(valid_countries), dtype="S2")
+    invalid = codes[~np.isin(codes, valid)]
+    assert invalid.size == 0, f"Invalid country codes returned: {invalid}"
 
-def test_1000_random_ips():
-    for _ in range(1000):
-        ipv4 = gen_rand_ipv4()
-        code = maxmind.get_country_from_ip(ipv4)
-        is_valid_country(code)
+
+def test_1000_random_ips_batched(monkeypatch, valid_countries):
+    """Random IPs resolve through the vectorized range-table search."""
+    rng = np.random.default_rng()
+    starts = np.unique(
+        np.append(rng.integers(0, 2**32, 5000, dtype=np.uint32), np.uint32(0))
+    )
+    ends = np.append(starts[1:] - 1, np.uint32(2**32 - 1))
+    codes = rng.choice(np.array(sorted(valid_countries), dtype="S2"), starts.size)
+    monkeypatch.setattr(maxmind, "ipv4_starts", starts)
+    monkeypatch.setattr(maxmind, "ipv4_ends", ends)
+    monkeypatch.setattr(maxmind, "ipv4_codes", codes)
+
+    def no_scalar_lookup(ip_address):
+        raise AssertionError(f"{ip_address} missed the range table")
+
+    monkeypatch.setattr(maxmind, "get_country_from_ip", no_scalar_lookup)
+
+    ips = rng.integers(0, 2**32, 1000, dtype=np.uint32)
+    result = maxmind.get_countries_from_ints(ips)
+
+    for ip, code in zip(ips, result):
+        ip_address = socket.inet_ntoa(struct.pack(">I", int(ip)))
+        assert maxmind.get_country_from_table(ip_address) == code.decode()
 
 
 def test_private_ips_default_to_gb():
@@ -30,6 +55,8 @@ def test_private_ips_default_to_gb():
     assert maxmind.get_country_from_ip("127.0.0.1") == "GB"
     assert maxmind.get_country_from_ip("192.168.0.10") == "GB"
     assert maxmind.get_country_from_ip("10.0.0.1") == "GB"
+    assert maxmind.get_country_from_ip("172.31.255.255") == "GB"
+    assert maxmind.get_country_from_ip("::1") == "GB"
 
 
 def test_invalid_ip_defaults_to_gb():
@@ -47,10 +74,53 @@ def test_invalid_ip_defaults_to_gb():
         "208.67.222.222",  # OpenDNS (US)
     ],
 )
-def test_real_ip_country_codes_are_valid(ip):
+def test_real_ip_country_codes_are_valid(ip, valid_countries):
     """Real IPs should return a valid ISO 3166-1 alpha-2 country code."""
     code = maxmind.get_country_from_ip(ip)
 
     assert isinstance(code, str), f"Expected string, got {type(code)}"
     assert len(code) == 2, f"Expected 2-letter code, got '{code}'"
-    assert code in VALID_COUNTRIES, f"Invalid country code returned: {code}"
+    is_valid_country(code, valid_countries)
+
+
+def test_reset_cache_clears_lookups():
+    maxmind.get_country_from_ip("127.0.0.1")
+    assert maxmind.get_country_from_ip.cache_info().currsize > 0
+
+    maxmind.reset_cache()
+    assert maxmind.get_country_from_ip.cache_info().currsize == 0
+
+
+def test_csv_table_lookup(tmp_path, monkeypatch):
+    """IPv4 lookups are served from the CSV range table when it is loaded."""
+    (tmp_path / "GeoLite2-Country-Locations-en.csv").write_text(
+        "geoname_id,locale_code,continent_code,continent_name,"
+        "country_iso_code,country_name,is_in_european_union\n"
+        "2661886,en,EU,Europe,SE,Sweden,1\n"
+        "1861060,en,AS,Asia,JP,Japan,0\n"
+        "6255148,en,EU,Europe,,,0\n"
+    )
+    (tmp_path / "GeoLite2-Country-Blocks-IPv4.csv").write_text(
+        "network,geoname_id,registered_country_geoname_id,"
+        "represented_country_geoname_id,is_anonymous_proxy,is_satellite_provider\n"
+        "1.0.0.0/24,1861060,1861060,,0,0\n"
+        "5.150.0.0/16,2661886,2661886,,0,0\n"
+        "5.200.0.0/16,6255148,6255148,,0,0\n"
+    )
+
+    starts, ends, codes = maxmind.load_country_csv(tmp_path)
+    assert codes.tolist() == [b"JP", b"SE"]
+
+    monkeypatch.setattr(maxmind, "ipv4_starts", starts)
+    monkeypatch.setattr(maxmind, "ipv4_ends", ends)
+    monkeypatch.setattr(maxmind, "ipv4_codes", codes)
+    maxmind.reset_cache()
+    try:
+        assert maxmind.get_country_from_ip("1.0.0.255") == "JP"
+        assert maxmind.get_country_from_ip("5.150.12.34") == "SE"
+        assert maxmind._lookup_ipv4_table(0x05970000) is None  # 5.151.0.0
+
+        ips = np.array([0x010000FF, 0x0A000001, 0x05960C22], dtype=np.uint32)
+        assert maxmind.get_countries_from_ints(ips).tolist() == [b"JP", b"GB", b"SE"]
+    finally:
+        maxmind.reset_cache()
@@ -0,0 +1,257 @@
+import asyncio
+from datetime import date, timedelta
+
+import pycountry
+import pytest
+import screenshot
+from screenshot import _country_init_script
+
+
+def test_country_init_script_pins_country():
+    script = _country_init_script("SE")
+    assert script.startswith("Object.defineProperty(window, 'country', {")
+    assert 'get: () => "SE"' in script
+    assert "set: () => {}" in script
+
+
+def test_cached_screenshot_renders_once(monkeypatch):
+    """Concurrent and repeat requests for a country share one render."""
+    calls = []
+
+    async def fake_capture(country_code, image_format):
+        calls.append((country_code, image_format))
+        await asyncio.sleep(0)
+        return b"image"
+
+    monkeypatch.setattr(screenshot, "capture_isitchristmas_screenshot", fake_capture)
+    monkeypatch.setattr(screenshot, "_SCREENSHOT_CACHE", {})
+
+    async def fetch():
+        first = await asyncio.gather(
+            screenshot.get_cached_screenshot("SE"),
+            screenshot.get_cached_screenshot("SE"),
+        )
+        return first + [await screenshot.get_cached_screenshot("SE")]
+
+    assert asyncio.run(fetch()) == [b"image"] * 3
+    assert calls == [("SE", "jpeg")]
+
+
+def test_claim_profiles_skips_locked_slots(tmp_path, monkeypatch):
+    """A second pool gets different profile directories until the first
+    releases its locks."""
+    monkeypatch.setattr(screenshot, "PROFILE_DIR", tmp_path)
+
+    first, first_locks = screenshot._claim_profiles(2)
+    second, second_locks = screenshot._claim_profiles(2)
+    assert [p.name for p in first] == ["slot-0", "slot-1"]
+    assert [p.name for p in second] == ["slot-2", "slot-3"]
+
+    for lock in first_locks + second_locks:
+        lock.close()
+    third, third_locks = screenshot._claim_profiles(1)
+    assert [p.name for p in third] == ["slot-0"]
+    third_locks[0].close()
+
+
+def test_blocked_url_patterns_cover_query_strings():
+    assert "*.woff2" in screenshot.BLOCKED_URL_PATTERNS
+    assert "*.woff2?*" in screenshot.BLOCKED_URL_PATTERNS
+    assert not any("png" in p for p in screenshot.BLOCKED_URL_PATTERNS)
+
+
+def test_cache_drops_earlier_days(monkeypatch):
+    async def fake_capture(country_code, image_format):
+        return b"today"
+
+    yesterday = date.today() - timedelta(days=1)
+    cache = {("US", "jpeg"): (yesterday, b"old"), ("SE", "jpeg"): (yesterday, b"old")}
+    monkeypatch.setattr(screenshot, "capture_isitchristmas_screenshot", fake_capture)
+    monkeypatch.setattr(screenshot, "_SCREENSHOT_CACHE", cache)
+
+    assert asyncio.run(screenshot.get_cached_screenshot("SE")) == b"today"
+    assert cache == {("SE", "jpeg"): (date.today(), b"today")}
+
+
+def test_render_across_midnight_keeps_new_day(monkeypatch):
+    """A render started yesterday must not evict entries rendered today."""
+    async def fake_capture(country_code, image_format):
+        return b"late"
+
+    today = date.today()
+    yesterday = today - timedelta(days=1)
+    cache = {("US", "jpeg"): (today, b"fresh"), ("SE", "jpeg"): (today, b"fresh")}
+    monkeypatch.setattr(screenshot, "capture_isitchristmas_screenshot", fake_capture)
+    monkeypatch.setattr(screenshot, "_SCREENSHOT_CACHE", cache)
+
+    assert asyncio.run(screenshot._render_and_cache(("SE", "jpeg"), yesterday))
+    assert cache == {
+        ("US", "jpeg"): (today, b"fresh"),
+        ("SE", "jpeg"): (today, b"fresh"),
+    }
+
+
+def test_cancel_pending_screenshots(monkeypatch):
+    """Shielded renders are cancelled and awaited, e.g. on shutdown."""
+    cancelled = []
+    started = []
+
+    async def slow_capture(country_code, image_format):
+        started.append(country_code)
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(country_code)
+            raise
+
+    monkeypatch.setattr(screenshot, "capture_isitchristmas_screenshot", slow_capture)
+    monkeypatch.setattr(screenshot, "_SCREENSHOT_CACHE", {})
+
+    async def run():
+        request = asyncio.ensure_future(screenshot.get_cached_screenshot("FR"))
+        while not started:
+            await asyncio.sleep(0)
+        await screenshot.cancel_pending_screenshots()
+        await asyncio.gather(request, return_exceptions=True)
+
+    asyncio.run(run())
+    assert cancelled == ["FR"]
+    assert screenshot._PENDING_SCREENSHOTS == {}
+
+
+def test_country_codes_are_iso_3166():
+    iso_codes = {c.alpha_2 for c in pycountry.countries}  # type: ignore
+    assert screenshot.COUNTRY_CODES == iso_codes | {"XK"}
+
+
+class FakeContext:
+    def __init__(self):
+        self.closed = False
+        self._close_handlers = []
+
+    def on(self, event, handler):
+        if event == "close":
+            self._close_handlers.append(handler)
+
+    async def close(self):
+        if not self.closed:
+            self.closed = True
+            for handler in self._close_handlers:
+                handler(self)
+
+
+class FakePlaywright:
+    async def start(self):
+        return self
+
+    async def stop(self):
+        pass
+
+
+class FakePool(screenshot.BrowserPool):
+    """BrowserPool that hands out FakeContexts instead of launching Chromium."""
+
+    def __init__(self, size):
+        super().__init__(size)
+        self.fail_launches = 0
+
+    async def _launch(self, slot):
+        if self.fail_launches:
+            self.fail_launches -= 1
+            raise RuntimeError("launch failed")
+        return FakeContext()
+
+
+@pytest.fixture
+def fake_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(screenshot, "PROFILE_DIR", tmp_path)
+    monkeypatch.setattr(screenshot, "async_playwright", FakePlaywright)
+
+    def make(size):
+        pool = FakePool(size)
+        asyncio.run(pool.start())
+        return pool
+
+    return make
+
+
+def test_pool_acquire_release(fake_pool):
+    """The semaphore bounds borrowers and released contexts are reused."""
+    pool = fake_pool(2)
+
+    async def run():
+        first = await pool.acquire()
+        second = await pool.acquire()
+        assert first is not second
+
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(pool.acquire(), timeout=0.01)
+
+        pool.release(first)
+        assert await pool.acquire() is first
+
+    asyncio.run(run())
+
+
+def test_pool_recycles_worn_out_contexts(fake_pool, monkeypatch):
+    monkeypatch.setattr(screenshot, "CONTEXT_MAX_USES", 2)
+    pool = fake_pool(1)
+
+    async def borrow():
+        context = await pool.acquire()
+        pool.release(context)
+        return context
+
+    async def run():
+        first, second, third = [await borrow() for _ in range(3)]
+        assert first is second
+        assert third is not first
+        assert first.closed
+
+    asyncio.run(run())
+
+
+def test_pool_relaunches_crashed_context(fake_pool):
+    pool = fake_pool(1)
+
+    async def run():
+        context = await pool.acquire()
+        pool.release(context)
+
+        await context.close()  # e.g. Chromium was OOM-killed
+        replacement = await pool.acquire()
+        assert replacement is not context
+        assert not replacement.closed
+
+    asyncio.run(run())
+
+
+def test_pool_retries_failed_relaunch(fake_pool):
+    """A failed relaunch returns the slot, and the next acquire tries again."""
+    pool = fake_pool(1)
+
+    async def run():
+        context = await pool.acquire()
+        pool.release(context)
+        await context.close()
+
+        pool.fail_launches = 1
+        with pytest.raises(RuntimeError):
+            await pool.acquire()
+
+        replacement = await asyncio.wait_for(pool.acquire(), timeout=1)
+        assert not replacement.closed
+
+    asyncio.run(run())
+
+
+def test_pool_release_after_stop_is_noop(fake_pool):
+    pool = fake_pool(1)
+
+    async def run():
+        context = await pool.acquire()
+        await pool.stop()
+        pool.release(context)
+        assert context.closed
+
+    asyncio.run(run())